@@ -1,30 +1,35 @@
 from __future__ import annotations
-import re
-from typing import Any, Dict, List
-from tqdm import trange
+import os, re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from tqdm import tqdm
 
 STRING_RE = r'"(?:[^"\\]|\\.)*"(?:@[A-Za-z\-]+|\^\^[^\s;,.{}()]+)?'
 IRI_RE    = r'<[^>]*>'
 PNAME_RE  = r'[^\s;,.{}()]+'
-SEP_RE    = r'[;,.]'
+SEP_RE    = r'[;,.{}]'
 TOKEN_RE  = rf'(?:{STRING_RE}|{IRI_RE}|{PNAME_RE}|{SEP_RE})'
 
 PREFIX_PATTERN = re.compile(r'PREFIX\s+([a-z0-9]+):\s*<([^>]+)>', re.I)
-WHERE_PATTERN  = re.compile(r'WHERE\s*\{(.+?)\}', re.I | re.S)
+WHERE_PATTERN  = re.compile(r'\bWHERE\s*\{', re.I)
 
-def _extract_triples(block_text: str) -> List[List[str]]:
-    strip = [
-        r'FILTER\s*\([^)]*\)', r'BIND\s*\([^)]*\)', r'GROUP\s+BY[^.}]*',
-        r'HAVING[^.}]*', r'ORDER\s+BY[^.}]*', r'LIMIT\s+\d+', r'OFFSET\s+\d+',
-    ]
-    for pat in strip:
-        block_text = re.sub(pat, '', block_text, flags=re.I | re.S)
+# Solution modifiers dropped from the WHERE body; matched in the same pass as the tokens.
+STRIP_RE = [
+    r'FILTER\s*\([^)]*\)', r'BIND\s*\([^)]*\)', r'GROUP\s+BY[^.{}]*',
+    r'HAVING[^.{}]*', r'ORDER\s+BY[^.{}]*', r'LIMIT\s+\d+', r'OFFSET\s+\d+',
+    r'SELECT\b[^{]*',  # projection of a sub-select, up to its group
+]
+STRIP_OR_TOKEN = re.compile(rf'(?P<strip>{"|".join(STRIP_RE)})|(?P<tok>{TOKEN_RE})', re.I)
 
-    tokens, triples, subj, pred = re.findall(TOKEN_RE, block_text), [], None, None
+def _extract_triples(where_text: str) -> List[List[str]]:
+    # One left-to-right pass; a group brace ends the current triple pattern just like '.'.
+    tokens = [m.group() for m in STRIP_OR_TOKEN.finditer(where_text) if m.lastgroup == 'tok']
+    triples, subj, pred = [], None, None
     i = 0
     while i < len(tokens):
         t = tokens[i]
-        if t == '.':
+        if t in ('.', '{', '}'):
             subj = pred = None
         elif t == ';':
             pred = None
@@ -39,69 +44,94 @@ def _extract_triples(block_text: str) -> List[List[str]]:
         i += 1
     return triples
 
-def _top_level_blocks(where_text: str) -> List[str]:
-    blocks, buf, depth = [], [], 0
-    for ch in where_text:
-        if ch == "{":
-            if depth == 0 and buf:
-                blocks.append("".join(buf).strip()); buf = []
+def _matching_brace(text: str, open_pos: int) -> int:
+    # Index of the '}' closing the '{' at open_pos, or -1; jumps between braces with str.find.
+    depth, o, c = 1, text.find("{", open_pos + 1), text.find("}", open_pos + 1)
+    while c >= 0:
+        if 0 <= o < c:
             depth += 1
-            if depth > 1:
-                buf.append(ch)
-        elif ch == "}":
-            depth -= 1
-            if depth > 0:
-                buf.append(ch)
-            else:
-                blocks.append("".join(buf).strip()); buf = []
+            o = text.find("{", o + 1)
         else:
-            buf.append(ch)
-    tail = "".join(buf).strip()
-    if tail:
-        blocks.append(tail)
-    return blocks
+            depth -= 1
+            if depth == 0:
+                return c
+            c = text.find("}", c + 1)
+    return -1
+
+@lru_cache(maxsize=1024)
+def _local_prefixes(prelude: str) -> Dict[str, str]:
+    # Shared across samples with the same prelude; callers must not mutate the result.
+    return dict(PREFIX_PATTERN.findall(prelude))
+
+def _parse_one(s: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Parse one sample in place; returns it with the PREFIX declarations it defines."""
+    query_text = s.get("formated_query") or s.get("query") or ""
+
+    ans_map: Dict[str, List[str]] = {}
+    for a in s.get("answers", []):
+        if isinstance(a, bool):
+            continue
+        v = next(iter(a))
+        ans_map.setdefault(v, []).append(a[v]["value"])
+    s["answers_value"] = ans_map
+
+    brace = query_text.find("{")  # PREFIX declarations all precede the first group
+    local = _local_prefixes(query_text if brace < 0 else query_text[:brace])
+
+    m = WHERE_PATTERN.search(query_text)
+    if not m:
+        s["triples"] = []
+        return s, local
+    end = _matching_brace(query_text, m.end() - 1)
+    where_txt = query_text[m.end():end] if end >= 0 else query_text[m.end():]
+
+    flat = _extract_triples(where_txt)
+
+    if not local:  # nothing to expand
+        s["triples"] = flat
+        return s, local
+
+    expanded = []
+    for tri in flat:
+        exp = []
+        for tok in tri:
+            i = tok.find(":")
+            p = tok[:i]
+            exp.append(f"{local[p]}:{tok[i + 1:]}" if i > 0 and p in local else tok)
+        expanded.append(exp)
+    s["triples"] = expanded
+    return s, local
 
 class SparqlParser:
-    def __init__(self) -> None:
+    """
+    Samples are parsed in place. With `num_workers` > 1 (None: one per CPU) inputs larger
+    than one chunk are parsed in a process pool; pickling every sample there and back caps
+    the gain, so it only pays off for large inputs on multi-core machines.
+    """
+    def __init__(self, num_workers: Optional[int] = 1, chunksize: int = 64) -> None:
         self.global_prefixes: Dict[str, str] = {}
+        self.num_workers = num_workers
+        self.chunksize = chunksize
 
     def parse_sparql(self, samples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        for idx in trange(len(samples), desc="Parsing SPARQL"):
-            s          = samples[idx]
-            query_text = s.get("formated_query") or s.get("query") or ""
-
-            ans_map: Dict[str, List[str]] = {}
-            for a in s.get("answers", []):
-                if isinstance(a, bool):
-                    continue
-                v = next(iter(a))
-                ans_map.setdefault(v, []).append(a[v]["value"])
-            s["answers_value"] = ans_map
-
-            local = dict(PREFIX_PATTERN.findall(query_text))
+        workers = self.num_workers or os.cpu_count() or 1
+        if workers == 1 or len(samples) <= self.chunksize:
+            self._collect(samples, map(_parse_one, samples))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                self._collect(samples, ex.map(_parse_one, samples, chunksize=self.chunksize))
+        return samples
+
+    def _collect(self, samples: List[Dict[str, Any]],
+                 results: Iterable[Tuple[Dict[str, Any], Dict[str, str]]]) -> None:
+        # Workers return copies, so copy their fields back into the caller's dicts; merging
+        # in input order keeps the first definition of each prefix, as the serial loop did.
+        for orig, (s, local) in zip(samples, tqdm(results, total=len(samples), desc="Parsing SPARQL")):
+            if s is not orig:
+                orig.update(s)
             for k, v in local.items():
                 self.global_prefixes.setdefault(k, v)
 
-            m = WHERE_PATTERN.search(query_text)
-            if not m:
-                s["triples"] = []
-                continue
-            where_txt = m.group(1)
-
-            flat = []
-            for block in _top_level_blocks(where_txt):
-                flat.extend(_extract_triples(block))
-
-            expanded = []
-            for tri in flat:
-                exp = []
-                for tok in tri:
-                    p, *tail = tok.split(":", 1)
-                    exp.append(f"{local[p]}:{tail[0]}" if tail and p in local else tok)
-                expanded.append(exp)
-            s["triples"] = expanded
-        return samples
-
     def run(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         return self.parse_sparql(data)
 
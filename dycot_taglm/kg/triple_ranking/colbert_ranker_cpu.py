@@ -1,5 +1,5 @@
 from __future__ import annotations
-import os, json, random
+import os, json, random, hashlib
 from typing import Any, Dict, List, Tuple
 from collections import defaultdict
 from pathlib import Path
@@ -20,18 +20,19 @@ torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS", "8")))
 from colbert.infra import Run, RunConfig, ColBERTConfig
 from colbert import Indexer, Searcher
 
+_WS_TABLE = str.maketrans({"\t": " ", "\n": " ", "\r": " "})
+
 def _clean_tok(x: Any) -> str:
-    return str(x).replace("\t", " ").replace("\n", " ").replace("\r", " ").strip()
+    return str(x).translate(_WS_TABLE).strip()
 
 def as_text(equiv: List[Any]) -> str:
-    s = " ".join(_clean_tok(x) for x in equiv)
-    return " ".join(s.split())
+    # split() already treats tabs/newlines as whitespace, so no per-token cleaning is needed
+    return " ".join(" ".join(map(str, equiv)).split())
 
-def _equiv_key(equiv: List[Any]) -> Tuple[str, str, str]:
-    t = tuple(_clean_tok(x) for x in equiv)
-    if len(t) != 3:
-        t = (t + ("", "", ""))[:3]
-    return t
+def _equiv_key(equiv: List[Any]) -> int:
+    # 64-bit hash of the cleaned, tab-joined triple; tabs cannot occur inside a cleaned token.
+    # Only used in-process, so per-process hash randomization is harmless.
+    return hash("\t".join(_clean_tok(x) for x in equiv))
 
 def build_global_collection(
     data: List[Dict[str, Any]],
@@ -39,12 +40,15 @@ def build_global_collection(
 ):
     Path(collection_tsv).parent.mkdir(parents=True, exist_ok=True)
 
-    equiv2docid: Dict[Tuple[str, str, str], int] = {}
+    equiv2docid: Dict[int, int] = {}
     docid2qids: Dict[int, set] = defaultdict(set)
-    docid2payload_by_qid: Dict[int, Dict[int, Dict[str, Any]]] = defaultdict(dict)
+    # (doc_id, q_id) -> row in the parallel payload_triples / payload_equivs lists
+    payload_idx: Dict[Tuple[int, int], int] = {}
+    payload_triples: List[Any] = []
+    payload_equivs: List[Any] = []
 
     did, written = 0, 0
-    with open(collection_tsv, "w", encoding="utf-8") as fout:
+    with open(collection_tsv, "wb", buffering=1 << 20) as fout:
         for entry in data:
             q_id = int(entry.get("id"))
             for item in entry.get("retrieved_triples", []):
@@ -59,19 +63,40 @@ def build_global_collection(
                 if not isinstance(equiv, (list, tuple)) or len(equiv) != 3:
                     continue
 
-                key = _equiv_key(list(equiv))
+                key = _equiv_key(equiv)
                 if key not in equiv2docid:
                     equiv2docid[key] = did
-                    text = as_text(list(equiv))
-                    fout.write(f"{did}\t{text}\n")
+                    text = as_text(equiv)
+                    fout.write(f"{did}\t{text}\n".encode("utf-8"))
                     did += 1
                     written += 1
 
                 doc_id = equiv2docid[key]
                 docid2qids[doc_id].add(q_id)
-                docid2payload_by_qid[doc_id][q_id] = {"triple": triple, "equivalent": list(equiv)}
-
-    return equiv2docid, docid2qids, docid2payload_by_qid, did, written
+                row = payload_idx.get((doc_id, q_id))
+                if row is None:
+                    payload_idx[(doc_id, q_id)] = len(payload_triples)
+                    payload_triples.append(triple)
+                    payload_equivs.append(equiv)
+                else:  # same doc retrieved twice for one question: last one wins
+                    payload_triples[row] = triple
+                    payload_equivs[row] = equiv
+
+    return equiv2docid, docid2qids, payload_idx, payload_triples, payload_equivs, did, written
+
+def _qid_to_docids(docid2qids: Dict[int, set]) -> Dict[int, np.ndarray]:
+    qid2docids: Dict[int, List[int]] = defaultdict(list)
+    for doc_id, qids in docid2qids.items():
+        for q_id in qids:
+            qid2docids[q_id].append(doc_id)
+    return {q_id: np.array(sorted(dids), dtype=np.int64) for q_id, dids in qid2docids.items()}
+
+def _index_fingerprint(collection_tsv: str, checkpoint: str, cfg_kwargs: Dict[str, Any]) -> str:
+    h = hashlib.sha256(f"{checkpoint}|{sorted(cfg_kwargs.items())}\n".encode("utf-8"))
+    with open(collection_tsv, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 def index_collection(
     collection_tsv: str,
@@ -80,21 +105,34 @@ def index_collection(
     root_dir: str = "experiments",
     checkpoint: str = "colbertv2.0",
     doc_maxlen: int | None = None,
-    overwrite_index: bool = True
+    overwrite_index: bool = True,
+    reuse_unchanged: bool = True
 ):
+    """
+    Encoding the collection dominates indexing, so an index built from byte-identical
+    collection/checkpoint/settings is reused (fingerprint in `collection.sha256`).
+    """
     with Run().context(RunConfig(nranks=1, experiment=experiment)):
         cfg_kwargs = dict(nbits=2, root=root_dir, amp=False)
         if doc_maxlen is not None:
             cfg_kwargs["doc_maxlen"] = doc_maxlen
         config = ColBERTConfig(**cfg_kwargs)
+        index_path = os.path.join(config.root, experiment, "indexes", index_name)
+        stamp = Path(index_path) / "collection.sha256"
+        fingerprint = _index_fingerprint(collection_tsv, checkpoint, cfg_kwargs)
 
+        if reuse_unchanged and stamp.exists() and stamp.read_text(encoding="utf-8").strip() == fingerprint:
+            print(f"[index] collection unchanged, reusing {index_path}")
+            return index_path, config
+
+        stamp.unlink(missing_ok=True)  # the index is about to change; a failed build must not look reusable
         indexer = Indexer(checkpoint=checkpoint, config=config)
         indexer.index(
             name=index_name,
             collection=collection_tsv,
             overwrite=("force_silent_overwrite" if overwrite_index else False),
         )
-        index_path = os.path.join(config.root, experiment, "indexes", index_name)
+        stamp.write_text(fingerprint, encoding="utf-8")  # only reached once indexing succeeded
     return index_path, config
 
 def run_colbert_ranking(
@@ -106,15 +144,15 @@ def run_colbert_ranking(
     root_dir: str = "experiments",
     checkpoint: str = "colbertv2.0",
     top_k: int = 100,
-    seed: int = 42
+    seed: int = 42,
+    reindex: bool = False
 ) -> None:
     random.seed(seed); np.random.seed(seed); torch.manual_seed(seed)
 
     data: List[Dict[str, Any]] = json.loads(Path(input_json).read_text(encoding="utf-8"))
 
-    equiv2docid, docid2qids, docid2payload_by_qid, total_docs, written = build_global_collection(
-        data, collection_tsv
-    )
+    (equiv2docid, docid2qids, payload_idx, payload_triples, payload_equivs,
+     total_docs, written) = build_global_collection(data, collection_tsv)
     print(f"[collection] wrote {written} unique docs to {collection_tsv}")
 
     index_path, base_config = index_collection(
@@ -123,27 +161,33 @@ def run_colbert_ranking(
         index_name=index_name,
         root_dir=root_dir,
         checkpoint=checkpoint,
-        overwrite_index=True
+        overwrite_index=True,
+        reuse_unchanged=not reindex
     )
     print(f"[index] ready at {index_path}")
 
     searcher = Searcher(index=index_path, collection=collection_tsv, config=base_config)
+    qid2docids = _qid_to_docids(docid2qids)
+    no_docs = np.empty(0, dtype=np.int64)
 
     for entry in data:
         q_id = int(entry["id"])
         query = entry.get("question", "")
         doc_ids, ranks, scores = searcher.search(query, k=top_k)
-        rel = [(did, rnk, sc) for did, rnk, sc in zip(doc_ids, ranks, scores) if q_id in docid2qids.get(did, set())]
-        rel.sort(key=lambda x: x[2], reverse=True)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64)
+        # keep hits that belong to this question, best score first (stable, like list.sort)
+        keep = np.flatnonzero(np.isin(doc_ids, qid2docids.get(q_id, no_docs), assume_unique=True))
+        keep = keep[np.argsort(-scores[keep], kind="stable")]
 
         ranked = []
-        for final_rank, (did, orig_rank, score) in enumerate(rel, 1):
-            payload = docid2payload_by_qid[did][q_id]
+        for final_rank, i in enumerate(keep, 1):
+            row = payload_idx[(int(doc_ids[i]), q_id)]
             ranked.append({
-                "triple": payload["triple"],
-                "equivalent": payload["equivalent"],
-                "score": float(score),
-                "original_colbert_rank": int(orig_rank),
+                "triple": payload_triples[row],
+                "equivalent": list(payload_equivs[row]),
+                "score": float(scores[i]),
+                "original_colbert_rank": int(ranks[i]),
                 "final_rank": int(final_rank),
             })
         entry["retrieved_triples_ranked"] = ranked
@@ -164,5 +208,6 @@ if __name__ == "__main__":
     p.add_argument("--checkpoint", default="colbertv2.0")
     p.add_argument("--top_k", type=int, default=100)
     p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--reindex", action="store_true", help="rebuild the index even if the collection is unchanged")
     args = p.parse_args()
     run_colbert_ranking(**vars(args))
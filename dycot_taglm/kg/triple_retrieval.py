@@ -1,8 +1,11 @@
 from __future__ import annotations
-import json, os, re, time, urllib.error
+import json, os, time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any, Dict, List, Tuple
-from tqdm import trange
-from SPARQLWrapper import SPARQLWrapper, JSON as SPARQLJSON
+from tqdm import tqdm
+import requests
+from requests.adapters import HTTPAdapter
 
 PREFIX_MAP = {
     "http://dbpedia.org/ontology/": "dbo",
@@ -23,7 +26,19 @@ PREFIX_MAP = {
     "http://purl.org/linguistics/gold/": "gold",
 }
 _PREFIX_ORDER = sorted(PREFIX_MAP.items(), key=lambda kv: -len(kv[0]))
+SPARQL_JSON   = "application/sparql-results+json"
+_RETRY_STATUS = {429, 502, 503, 504}
 
+class _UriCharTable(dict):
+    """str.translate table equivalent to re.sub(r"[^\w\s-]", "", s); filled lazily per code point."""
+    def __missing__(self, cp: int):
+        ch = chr(cp)
+        self[cp] = cp if (ch.isalnum() or ch.isspace() or ch in "_-") else None
+        return self[cp]
+
+_URI_CHARS = _UriCharTable()
+
+@lru_cache(maxsize=1 << 20)
 def _shorten(uri: str) -> str:
     if uri.startswith("<") and uri.endswith(">"):
         uri = uri[1:-1]
@@ -37,7 +52,10 @@ class DBpediaRetriever:
     For each entity (string like 'Paris'), fetch outgoing & incoming resource-only triples.
     Writes: sample['retrieved_triples'] = List[List[Tuple[str,str,str]]]
             (list per entity)
-    Includes checkpointing to resume long jobs.
+    Includes checkpointing to resume long jobs: the checkpoint is append-only JSONL with
+    one line per finished sample and one per fetched entity.
+    Entities of `batch_size` samples at a time are fetched by `concurrency` threads.
+    Each distinct entity is fetched once and memoized in `_entity_cache`.
     """
     def __init__(
         self,
@@ -45,8 +63,10 @@ class DBpediaRetriever:
         timeout: int = 3000,
         max_retries: int = 5,
         retry_sleep: int = 10,
-        checkpoint_file: str = "checkpoint.json",
+        checkpoint_file: str = "checkpoint.jsonl",
         remove_checkpoint_on_complete: bool = True,
+        concurrency: int = 16,
+        batch_size: int = 32,
     ):
         self.endpoint  = endpoint
         self.timeout   = timeout
@@ -54,44 +74,66 @@ class DBpediaRetriever:
         self.retry_sleep = retry_sleep
         self.checkpoint_file = checkpoint_file
         self.remove_checkpoint_on_complete = remove_checkpoint_on_complete
+        self.concurrency = concurrency
+        self.batch_size  = batch_size
+        self._entity_cache: Dict[str, List[Tuple[str, str, str]]] = {}
+        # one keep-alive pool shared by all fetch threads
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
 
     def run(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         existing = self._load_checkpoint()
         done_ids = {rec["id"] for rec in existing}
         cache    = {rec["id"]: rec for rec in existing}
 
-        for i in trange(len(data), desc="Retrieving DBpedia triples"):
-            sample = data[i]
-            sid    = sample.get("id")
-
-            if sid in done_ids:
-                data[i]["retrieved_triples"] = cache[sid]["retrieved_triples"]
-                continue
-
-            triples_by_entity: List[List[Tuple[str, str, str]]] = []
-            for ent in sample.get("entities", []):
-                cleaned = self._clean_uri(ent)
-                if not cleaned:
-                    triples_by_entity.append([("SKIPPED", "SKIPPED", _shorten(ent))])
-                    continue
-                triples = self._fetch_dbpedia_triples(cleaned)
-                triples_by_entity.append(triples)
+        with open(self.checkpoint_file, "a", encoding="utf-8") as ckpt, \
+             ThreadPoolExecutor(max_workers=self.concurrency) as ex, \
+             tqdm(total=len(data), desc="Retrieving DBpedia triples") as pbar:
+            for start in range(0, len(data), self.batch_size):
+                batch = data[start:start + self.batch_size]
+                pending, inflight = [], {}
+                for sample in batch:
+                    sid = sample.get("id")
+                    if sid in done_ids:
+                        sample["retrieved_triples"] = cache[sid]["retrieved_triples"]
+                        continue
+                    jobs = []
+                    for ent in sample.get("entities", []):
+                        cleaned = self._clean_uri(ent)
+                        if cleaned and cleaned not in self._entity_cache and cleaned not in inflight:
+                            inflight[cleaned] = ex.submit(self._fetch_dbpedia_triples, cleaned)
+                        jobs.append((ent, cleaned))
+                    pending.append((sample, jobs))
 
-            sample["retrieved_triples"] = triples_by_entity
-            cache[sid] = {"id": sid, "retrieved_triples": triples_by_entity}
-            done_ids.add(sid)
-            if i % 10 == 0:
-                self._save_checkpoint(list(cache.values()))
+                for cleaned, fut in inflight.items():
+                    triples = fut.result()
+                    if triples is None:  # retries exhausted: not memoized, so later samples and resumes retry
+                        continue
+                    self._entity_cache[cleaned] = triples
+                    self._append_checkpoint(ckpt, {"entity": cleaned, "triples": triples})
+                for sample, jobs in pending:
+                    sid = sample.get("id")
+                    triples_by_entity: List[List[Tuple[str, str, str]]] = [
+                        self._entity_cache[cleaned] if cleaned in self._entity_cache
+                        else [("SKIPPED", "SKIPPED", _shorten(cleaned or ent))]
+                        for ent, cleaned in jobs
+                    ]
+                    sample["retrieved_triples"] = triples_by_entity
+                    cache[sid] = {"id": sid, "retrieved_triples": triples_by_entity}
+                    done_ids.add(sid)
+                    self._append_checkpoint(ckpt, cache[sid])
+                ckpt.flush()
+                pbar.update(len(batch))
 
-        self._save_checkpoint(list(cache.values()))
         if self.remove_checkpoint_on_complete and os.path.exists(self.checkpoint_file):
             os.remove(self.checkpoint_file)
         return data
 
     # --- helpers ---
-    def _fetch_dbpedia_triples(self, entity: str) -> List[Tuple[str, str, str]]:
-        sparql = SPARQLWrapper(self.endpoint)
-        sparql.setTimeout(self.timeout)
+    def _fetch_dbpedia_triples(self, entity: str) -> List[Tuple[str, str, str]] | None:
+        """Triples for `entity`; None if it still failed transiently after `max_retries` attempts."""
         q = f"""
             SELECT ?subject ?predicate ?object WHERE {{
               {{ <http://dbpedia.org/resource/{entity}> ?predicate ?object .
@@ -101,19 +143,27 @@ class DBpediaRetriever:
                  FILTER(STRSTARTS(STR(?subject), "http://dbpedia.org/resource/")) }}
             }}
         """
-        sparql.setQuery(q)
-        sparql.setReturnFormat(SPARQLJSON)
 
         for attempt in range(self.max_retries):
             try:
-                res = sparql.query().convert()
+                r = self._session.post(self.endpoint, data={"query": q, "format": SPARQL_JSON},
+                                       headers={"Accept": SPARQL_JSON}, timeout=self.timeout)
+                r.raise_for_status()
+                res = r.json()
                 break
-            except (urllib.error.HTTPError, urllib.error.URLError) as e:
+            except ValueError as e:  # body was not JSON
+                print(f"[SPARQL error] {e}")
+                return [("SKIPPED", "SKIPPED", _shorten(entity))]
+            except requests.RequestException as e:
+                status = getattr(e.response, "status_code", None)
+                if status is not None and status not in _RETRY_STATUS:
+                    print(f"[SPARQL error] {e}")
+                    return [("SKIPPED", "SKIPPED", _shorten(entity))]
                 print(f"[Retry {attempt+1}/{self.max_retries}] {e}")
                 if attempt < self.max_retries - 1:
                     time.sleep(self.retry_sleep)
                 else:
-                    return [("SKIPPED", "SKIPPED", _shorten(entity))]
+                    return None
             except Exception as e:
                 print(f"[SPARQL error] {e}")
                 return [("SKIPPED", "SKIPPED", _shorten(entity))]
@@ -127,16 +177,28 @@ class DBpediaRetriever:
         return triples
 
     def _clean_uri(self, entity: str) -> str:
-        entity = re.sub(r"[^\w\s-]", "", entity).replace(" ", "_")
+        entity = entity.translate(_URI_CHARS).replace(" ", "_")
         return entity.strip()
 
     def _load_checkpoint(self) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
         try:
             with open(self.checkpoint_file, encoding="utf-8") as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:  # e.g. a line cut short by a crash
+                        continue
+                    if not isinstance(rec, dict):
+                        continue
+                    if "entity" in rec:
+                        self._entity_cache[rec["entity"]] = rec["triples"]
+                    elif "id" in rec:
+                        results.append(rec)
+        except FileNotFoundError:
+            pass
+        return results
 
-    def _save_checkpoint(self, results: List[Dict[str, Any]]) -> None:
-        with open(self.checkpoint_file, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=4, ensure_ascii=False)
\ No newline at end of file
+    @staticmethod
+    def _append_checkpoint(f, record: Dict[str, Any]) -> None:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
\ No newline at end of file
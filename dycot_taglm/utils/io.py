@@ -1,14 +1,37 @@
 from __future__ import annotations
 import json
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback; same output layout, just slower
+    orjson = None
+
+def dumps_json(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+def loads_json(raw: bytes | str) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
 
 def save_json(data: Any, path: str | Path) -> None:
     p = Path(path)
     p.parent.mkdir(parents=True, exist_ok=True)
-    with p.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    p.write_bytes(dumps_json(data))
+
+def save_json_array(records: Iterable[Any], path: str | Path) -> None:
+    """Write a JSON array one element at a time, so only one encoded record is held in memory."""
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with p.open("wb") as f:
+        f.write(b"[")
+        sep = b"\n"
+        for rec in records:
+            f.write(sep); f.write(dumps_json(rec))
+            sep = b",\n"
+        f.write(b"\n]")
 
 def load_json(path: str | Path) -> Any:
-    with Path(path).open("r", encoding="utf-8") as f:
-        return json.load(f)
\ No newline at end of file
+    return loads_json(Path(path).read_bytes())
\ No newline at end of file
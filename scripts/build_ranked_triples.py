@@ -35,7 +35,7 @@ def build_qald_flow(in_raw: str, workdir: str, entity_extractor: str = "refined"
     save_json(data, work / f"qald9_entities_{entity_extractor}.json")
 
     # 4) DBpedia triples
-    retr = DBpediaRetriever(checkpoint_file=str(work / "checkpoint_qald.json"))
+    retr = DBpediaRetriever(checkpoint_file=str(work / "checkpoint_qald.jsonl"))
     data = retr.run(data)
     out_path = work / f"qald9_retrieved_triples_{entity_extractor}.json"
     save_json(data, out_path)
@@ -56,7 +56,7 @@ def build_lcquad_flow(in_raw: str, workdir: str, entity_extractor: str = "refine
     data = extractor.run(data)
     save_json(data, work / f"lcquad_entities_{entity_extractor}.json")
 
-    retr = DBpediaRetriever(checkpoint_file=str(work / "checkpoint_lcquad.json"))
+    retr = DBpediaRetriever(checkpoint_file=str(work / "checkpoint_lcquad.jsonl"))
     data = retr.run(data)
     out_path = work / f"lcquad_retrieved_triples_{entity_extractor}.json"
     save_json(data, out_path)
@@ -77,7 +77,7 @@ def build_vquanda_flow(in_raw: str, workdir: str, entity_extractor: str = "refin
     data = extractor.run(data)
     save_json(data, work / f"vquanda_entities_{entity_extractor}.json")
 
-    retr = DBpediaRetriever(checkpoint_file=str(work / "checkpoint_vquanda.json"))
+    retr = DBpediaRetriever(checkpoint_file=str(work / "checkpoint_vquanda.jsonl"))
     data = retr.run(data)
     out_path = work / f"vquanda_retrieved_triples_{entity_extractor}.json"
     save_json(data, out_path)
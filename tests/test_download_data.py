@@ -0,0 +1,28 @@
+import importlib.util, io, tarfile
+from pathlib import Path
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "download_data", Path(__file__).resolve().parents[1] / "scripts" / "download_data.py")
+dd = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(dd)
+
+def _hardlink_tar(path: Path) -> Path:
+    with tarfile.open(path, "w:gz") as t:
+        ti = tarfile.TarInfo("root/f.txt"); ti.size = 3
+        t.addfile(ti, io.BytesIO(b"abc"))
+        ti = tarfile.TarInfo("root/h.txt"); ti.type = tarfile.LNKTYPE; ti.linkname = "root/f.txt"
+        t.addfile(ti)
+    return path
+
+@pytest.mark.parametrize("strip", [0, 1])
+def test_reextract_tar_with_hard_links(tmp_path, strip):
+    archive = _hardlink_tar(tmp_path / "arc.tar.gz")
+    out = tmp_path / "out"
+    out.mkdir()
+    dd._extract(archive, out, strip=strip)
+    dd._extract(archive, out, strip=strip)  # files from the first run are already there
+    base = out if strip else out / "root"
+    assert (base / "f.txt").read_bytes() == b"abc"
+    assert (base / "h.txt").read_bytes() == b"abc"